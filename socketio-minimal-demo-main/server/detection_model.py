@@ -2,81 +2,156 @@ import cv2
 import numpy as np
 from PIL import Image
 import fitz
-import io
 import logging
+from numba import njit
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
-def detect_vertical_simple_pil(pil_image):
+# Bump whenever detection output changes so cached results from older versions are not replayed
+DETECTION_VERSION = 1
+# Longest side, in pixels, that pages are downscaled to before orientation analysis
+THUMBNAIL_SIZE = 256
+# Grayscale level above which a pixel counts as foreground
+FOREGROUND_THRESHOLD = 127
+# Most pages analyze_document holds in memory while they wait on the process pool
+ANALYZE_BATCH_SIZE = 2 * (os.cpu_count() or 1)
+
+# Shared pool that runs detection in worker processes so pages scale across cores regardless of the GIL
+_process_pool = None
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # Forking the threaded server process can copy held locks into workers, so start them clean
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(start_method))
+    return _process_pool
+
+def reset_process_pool(broken_pool):
+    # A crashed worker breaks the whole pool, so drop it and let the next job build a fresh one
+    global _process_pool
+    if _process_pool is broken_pool:
+        _process_pool = None
+    broken_pool.shutdown(wait=False)
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
+
+@njit(cache=True)
+def bbox_nonzero(gray):
+    rows, cols = gray.shape
+    ymin, ymax, xmin, xmax = rows, -1, cols, -1
+    for i in range(rows):
+        for j in range(cols):
+            if gray[i, j]:
+                if i < ymin:
+                    ymin = i
+                ymax = i
+                if j < xmin:
+                    xmin = j
+                if j > xmax:
+                    xmax = j
+    if ymax < 0:
+        return 0, 0
+    return xmax - xmin + 1, ymax - ymin + 1
+
+def detect_vertical_simple(img_array):
     try:
-        img_array = np.array(pil_image)
+        height, width = img_array.shape[:2]
+        scale_x = scale_y = 1.0
+        if max(height, width) > THUMBNAIL_SIZE:
+            scale = THUMBNAIL_SIZE / max(height, width)
+            thumb_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            img_array = cv2.resize(img_array, thumb_size, interpolation=cv2.INTER_AREA)
+            scale_x, scale_y = width / thumb_size[0], height / thumb_size[1]
         if len(img_array.shape) == 3:
             gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
         else:
             gray = img_array
-        contours, _ = cv2.findContours(gray, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            largest = max(contours, key=cv2.contourArea)
-            x, y, w, h = cv2.boundingRect(largest)
+        # Threshold so faint anti-aliased edges left by the resize don't widen the box
+        w, h = bbox_nonzero(gray > FOREGROUND_THRESHOLD)
+        if h > 0:
+            # Report the box in the original image's pixel space
+            w, h = round(w * scale_x), round(h * scale_y)
             aspect_ratio = w / h if h > 0 else 0
             is_vertical = aspect_ratio < 1
-            logger.info(f"Width: {w}, Height: {h}")
-            logger.info(f"Aspect ratio: {aspect_ratio:.2f}")
-            logger.info(f"Text is: {'Vertical' if is_vertical else 'Horizontal'}")
+            logger.info("Width: %d, Height: %d", w, h)
+            logger.info("Aspect ratio: %.2f", aspect_ratio)
+            logger.info("Text is: %s", 'Vertical' if is_vertical else 'Horizontal')
             return is_vertical, aspect_ratio, w, h
-        logger.warning("No contours found in image")
+        logger.warning("No foreground pixels found in image")
         return False, 0, 0, 0
     except Exception as e:
-        logger.error(f"Error in detect_vertical_simple_pil: {e}")
+        logger.error(f"Error in detect_vertical_simple: {e}")
         return False, 0, 0, 0
 
-def get_pdf_page_count(file_path):
+def detect_vertical_simple_pil(pil_image):
+    return detect_vertical_simple(np.asarray(pil_image))
+
+def load_image_array(file_path):
+    with Image.open(file_path) as pil_image:
+        return np.asarray(pil_image)
+
+def load_pdf(file_path):
+    doc = fitz.open(file_path)
+    logger.info(f"PDF has {len(doc)} pages: {file_path}")
+    return doc
+
+@contextmanager
+def open_pdf(file_path):
+    doc = load_pdf(file_path)
     try:
-        doc = fitz.open(file_path)
-        page_count = len(doc)
+        yield doc
+    finally:
         doc.close()
-        logger.info(f"PDF has {page_count} pages: {file_path}")
-        return page_count
-    except Exception as e:
-        logger.error(f"Error getting page count from PDF {file_path}: {e}")
-        return 0
 
-def extract_pages_from_pdf(file_path):
+def render_pdf_page(doc, page_num):
+    pix = doc[page_num - 1].get_pixmap(matrix=fitz.Matrix(0.5, 0.5))
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+def iter_pdf_pages(doc):
     try:
-        doc = fitz.open(file_path)
-        pages = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            mat = fitz.Matrix(2.0, 2.0)
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("ppm")
-            pil_image = Image.open(io.BytesIO(img_data))
-            pages.append(pil_image)
-        doc.close()
-        logger.info(f"Successfully extracted {len(pages)} pages from PDF: {file_path}")
-        return pages
+        total_pages = len(doc)
+        for page_num in range(1, total_pages + 1):
+            yield page_num, total_pages, render_pdf_page(doc, page_num)
     except Exception as e:
-        logger.error(f"Error extracting pages from PDF {file_path}: {e}")
-        return []
+        logger.error(f"Error extracting pages from PDF {doc.name}: {e}")
 
 def analyze_document(file_path):
     try:
         results = {'file_type': 'unknown', 'total_pages': 0, 'results': []}
         if file_path.lower().endswith('.pdf'):
             results['file_type'] = 'pdf'
-            pages = extract_pages_from_pdf(file_path)
-            results['total_pages'] = len(pages)
-            for page_num, pil_image in enumerate(pages, 1):
-                is_vertical, aspect_ratio, width, height = detect_vertical_simple_pil(pil_image)
-                page_result = {
-                    'page': page_num,
-                    'is_vertical': is_vertical,
-                    'aspect_ratio': round(aspect_ratio, 2),
-                    'width': width,
-                    'height': height,
-                    'orientation': 'Vertical' if is_vertical else 'Horizontal'
-                }
-                results['results'].append(page_result)
+            pool = get_process_pool()
+            with open_pdf(file_path) as doc:
+                results['total_pages'] = len(doc)
+                pages = iter_pdf_pages(doc)
+                # Executor.map submits its whole input up front, so feed it fixed-size batches to bound memory
+                while batch := list(islice(pages, ANALYZE_BATCH_SIZE)):
+                    try:
+                        detections = list(pool.map(detect_vertical_simple, [img_array for _, _, img_array in batch]))
+                    except BrokenProcessPool:
+                        reset_process_pool(pool)
+                        raise
+                    for (page_num, _, _), (is_vertical, aspect_ratio, width, height) in zip(batch, detections):
+                        page_result = {
+                            'page': page_num,
+                            'is_vertical': is_vertical,
+                            'aspect_ratio': round(aspect_ratio, 2),
+                            'width': width,
+                            'height': height,
+                            'orientation': 'Vertical' if is_vertical else 'Horizontal'
+                        }
+                        results['results'].append(page_result)
         else:
             results['file_type'] = 'image'
             results['total_pages'] = 1
@@ -3,11 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uuid
 import asyncio
+import aiofiles
+import hashlib
 import logging
 import os
 from pathlib import Path
-from detection_model import detect_vertical_simple_pil, extract_pages_from_pdf, analyze_document, get_pdf_page_count
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from detection_model import DETECTION_VERSION, detect_vertical_simple, get_process_pool, reset_process_pool, shutdown_process_pool, load_image_array, load_pdf, render_pdf_page, analyze_document
 from redis_manager import RedisManager
 
 app = FastAPI()
@@ -34,6 +37,16 @@ class DetectionResult(BaseModel):
 detection_sessions = {}
 redis_manager = RedisManager()
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+RESULT_CACHE_TTL = 3600
+RENDER_QUEUE_SIZE = 8
+RESULT_QUEUE_SIZE = 32
+MAX_IN_FLIGHT_PAGES = 16
+# PyMuPDF is not thread-safe, so all rendering stays on a single worker
+render_executor = ThreadPoolExecutor(max_workers=1)
+# Created in startup: before Python 3.10, asyncio primitives bind to the loop current at construction
+detection_semaphore = None
+
 @app.post("/api/upload-document")
 async def upload_document(file: UploadFile = File(...), client_id: str = Form(...)):
     logger.info(f"File upload request received - Client ID: {client_id}, Filename: {file.filename}")
@@ -48,11 +61,17 @@ async def upload_document(file: UploadFile = File(...), client_id: str = Form(..
         }
     
     file_path = uploads_dir / f"{client_id}_{file.filename}"
-    content = await file.read()
-    file_size = len(content)
+    file_size = 0
+    # Hash while streaming so identical uploads can reuse cached results
+    digest = hashlib.blake2b(digest_size=16)
     
-    with open(file_path, "wb") as f:
-        f.write(content)
+    async with aiofiles.open(file_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            digest.update(chunk)
+            await f.write(chunk)
+    # The extension picks the PDF or image path, so identical bytes uploaded under another type get their own entry
+    cache_key = f"det:v{DETECTION_VERSION}:{file_extension.lstrip('.')}:{digest.hexdigest()}"
     
     logger.info(f"File saved successfully - Client: {client_id}, Size: {file_size} bytes, Path: {file_path}")
     
@@ -63,53 +82,151 @@ async def upload_document(file: UploadFile = File(...), client_id: str = Form(..
     }
     
     logger.info(f"Starting background processing for client {client_id}")
-    asyncio.create_task(process_document_detection(client_id, str(file_path)))
+    asyncio.create_task(process_document_detection(client_id, str(file_path), cache_key))
     
     return {"client_id": client_id, "status": "uploaded", "filename": file.filename}
-async def process_document_detection(client_id: str, file_path: str):
+
+async def detect_page(img_array):
+    async with detection_semaphore:
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, detect_vertical_simple, img_array)
+        except BrokenProcessPool:
+            logger.error("Detection worker process died, rebuilding the process pool")
+            reset_process_pool(pool)
+            raise
+
+async def send_pdf_page_count(client_id: str, total_pages: int):
+    logger.info(f"PDF analysis - Client: {client_id}, Total pages: {total_pages}")
+    await send_detection_update(client_id, "analyzing", 0.1, f"{total_pages} pages detected")
+    await send_page_count_update(client_id, total_pages)
+
+async def close_pdf(opening: asyncio.Future):
+    try:
+        doc = await opening
+    except Exception:
+        return
+    # Queued behind any page still rendering on the worker, so the document is never closed mid-render
+    await asyncio.get_running_loop().run_in_executor(render_executor, doc.close)
+
+async def render_stage(client_id: str, file_path: str, render_q: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    # Every PyMuPDF call goes through the render worker, one page per call so concurrent documents take turns
+    opening = loop.run_in_executor(render_executor, load_pdf, file_path)
+    try:
+        # Shielded so a stage cancelled mid-open still gets the document back and closes it
+        doc = await asyncio.shield(opening)
+        total_pages = await loop.run_in_executor(render_executor, len, doc)
+        await send_pdf_page_count(client_id, total_pages)
+        for page_num in range(1, total_pages + 1):
+            try:
+                img_array = await loop.run_in_executor(render_executor, render_pdf_page, doc, page_num)
+            except Exception as e:
+                logger.error(f"Error extracting pages from PDF {file_path}: {e}")
+                break
+            await render_q.put((page_num, total_pages, img_array))
+        await render_q.put(None)
+        return total_pages
+    finally:
+        await asyncio.shield(close_pdf(opening))
+
+async def detect_stage(render_q: asyncio.Queue, result_q: asyncio.Queue):
+    while (item := await render_q.get()) is not None:
+        page_num, total_pages, img_array = item
+        # Hand the pending detection downstream so pages are analyzed concurrently but published in order
+        detection = asyncio.create_task(detect_page(img_array))
+        try:
+            await result_q.put((page_num, total_pages, detection))
+        except asyncio.CancelledError:
+            detection.cancel()
+            raise
+    await result_q.put(None)
+
+async def cancel_pipeline(stages: list, result_q: asyncio.Queue):
+    for stage in stages:
+        stage.cancel()
+    await asyncio.gather(*stages, return_exceptions=True)
+    # Detections still queued for publishing belong to the failed job; stop them and collect their errors
+    pending = []
+    while not result_q.empty():
+        item = result_q.get_nowait()
+        if item is not None:
+            item[2].cancel()
+            pending.append(item[2])
+    await asyncio.gather(*pending, return_exceptions=True)
+
+async def publish_stage(client_id: str, result_q: asyncio.Queue, page_results: list):
+    while (item := await result_q.get()) is not None:
+        page_num, total_pages, detection = item
+        logger.info("Processing page %d/%d for client %s", page_num, total_pages, client_id)
+        is_vertical, aspect_ratio, width, height = await detection
+        orientation = "Vertical" if is_vertical else "Horizontal"
+        logger.info("Page %d analysis - Client: %s, Orientation: %s, Aspect Ratio: %.2f", page_num, client_id, orientation, aspect_ratio)
+        await send_detection_update(client_id, "processing", 
+                                  (page_num / total_pages) * 0.8, 
+                                  f"Page {page_num}/{total_pages}: {orientation}")
+        
+        result = {
+            "page": page_num,
+            "is_vertical": is_vertical,
+            "aspect_ratio": round(aspect_ratio, 2),
+            "width": width,
+            "height": height,
+            "orientation": orientation
+        }
+        
+        await send_page_result_update(client_id, page_num, result)
+        page_results.append(result)
+
+async def replay_cached_results(client_id: str, results: dict):
+    total_pages = results['total_pages']
+    page_label = "1 page detected" if results['file_type'] == 'image' else f"{total_pages} pages detected"
+    await send_detection_update(client_id, "analyzing", 0.1, page_label)
+    await send_page_count_update(client_id, total_pages)
+    for result in results['results']:
+        page_num = result['page']
+        await send_detection_update(client_id, "processing", 
+                                  (page_num / total_pages) * 0.8, 
+                                  f"Page {page_num}/{total_pages}: {result['orientation']}")
+        await send_page_result_update(client_id, page_num, result)
+    await send_detection_update(client_id, "completed", 1.0, "Detection completed")
+
+async def process_document_detection(client_id: str, file_path: str, cache_key: str = None):
     logger.info(f"Starting document processing for client {client_id} - File: {file_path}")
     try:
-        if file_path.lower().endswith('.pdf'):
+        results = None
+        cached = await load_cached_results(cache_key) if cache_key else None
+        if cached:
+            logger.info(f"Cache hit for client {client_id} - Replaying {cached['total_pages']} cached pages")
+            await replay_cached_results(client_id, cached)
+        elif file_path.lower().endswith('.pdf'):
             logger.info(f"Processing PDF document for client {client_id}")
-            await asyncio.sleep(0.5)
-            total_pages = get_pdf_page_count(file_path)
-            logger.info(f"PDF analysis - Client: {client_id}, Total pages: {total_pages}")
-            await send_detection_update(client_id, "analyzing", 0.1, f"{total_pages} pages detected")
-            await send_page_count_update(client_id, total_pages)
-            await asyncio.sleep(1)
             logger.info(f"Extracting pages from PDF for client {client_id}")
-            pages = extract_pages_from_pdf(file_path)
-            
-            for page_num, pil_image in enumerate(pages, 1):
-                logger.info(f"Processing page {page_num}/{total_pages} for client {client_id}")
-                is_vertical, aspect_ratio, width, height = detect_vertical_simple_pil(pil_image)
-                orientation = "Vertical" if is_vertical else "Horizontal"
-                logger.info(f"Page {page_num} analysis - Client: {client_id}, Orientation: {orientation}, Aspect Ratio: {aspect_ratio:.2f}")
-                await send_detection_update(client_id, "processing", 
-                                          (page_num / total_pages) * 0.8, 
-                                          f"Page {page_num}/{total_pages}: {orientation}")
-                
-                result = {
-                    "page": page_num,
-                    "is_vertical": is_vertical,
-                    "aspect_ratio": round(aspect_ratio, 2),
-                    "width": width,
-                    "height": height,
-                    "orientation": orientation
-                }
-                
-                await send_page_result_update(client_id, page_num, result)
-                await asyncio.sleep(1)
+            render_q = asyncio.Queue(maxsize=RENDER_QUEUE_SIZE)
+            result_q = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
+            page_results = []
+            stages = [
+                asyncio.create_task(render_stage(client_id, file_path, render_q)),
+                asyncio.create_task(detect_stage(render_q, result_q)),
+                asyncio.create_task(publish_stage(client_id, result_q, page_results)),
+            ]
+            try:
+                total_pages, _, _ = await asyncio.gather(*stages)
+            except Exception:
+                await cancel_pipeline(stages, result_q)
+                raise
             
             logger.info(f"PDF processing completed successfully for client {client_id} - {total_pages} pages processed")
             await send_detection_update(client_id, "completed", 1.0, "Detection completed")
+            results = {'file_type': 'pdf', 'total_pages': total_pages, 'results': page_results}
         else:
             logger.info(f"Processing single image for client {client_id}")
             await send_detection_update(client_id, "analyzing", 0.1, "1 page detected")
             await send_page_count_update(client_id, 1)
-            await asyncio.sleep(1)
-            pil_image = Image.open(file_path)
-            is_vertical, aspect_ratio, width, height = detect_vertical_simple_pil(pil_image)
+            loop = asyncio.get_running_loop()
+            img_array = await loop.run_in_executor(None, load_image_array, file_path)
+            is_vertical, aspect_ratio, width, height = await detect_page(img_array)
             orientation = "Vertical" if is_vertical else "Horizontal"
             logger.info(f"Image analysis - Client: {client_id}, Orientation: {orientation}, Aspect Ratio: {aspect_ratio:.2f}")
             await send_detection_update(client_id, "processing", 0.8, f"Page 1/1: {orientation}")
@@ -126,6 +243,11 @@ async def process_document_detection(client_id: str, file_path: str):
             await send_page_result_update(client_id, 1, result)
             logger.info(f"Image processing completed successfully for client {client_id}")
             await send_detection_update(client_id, "completed", 1.0, "Detection completed")
+            results = {'file_type': 'image', 'total_pages': 1, 'results': [result]}
+        
+        # Only cache complete runs; a PDF that failed to render yields fewer results than pages
+        if cache_key and results and results['total_pages'] and len(results['results']) == results['total_pages']:
+            await store_cached_results(cache_key, results)
             
         if client_id in detection_sessions:
             detection_sessions[client_id]["status"] = "completed"
@@ -136,39 +258,53 @@ async def process_document_detection(client_id: str, file_path: str):
         await send_detection_update(client_id, "error", 0.0, f"Error: {str(e)}")
 
 async def send_detection_update(client_id: str, status: str, confidence: float, message: str):
-    print(f"{message}")
-    logger.info(f"Sending detection update - Client: {client_id}, Status: {status}, Progress: {confidence:.1f}, Message: {message}")
+    logger.info("Sending detection update - Client: %s, Status: %s, Progress: %.1f, Message: %s", client_id, status, confidence, message)
     try:
         await redis_manager.publish_detection_update(client_id, status, confidence, message)
-        logger.debug(f"Detection update published to Redis successfully for client {client_id}")
+        if status in ("completed", "error"):
+            await redis_manager.flush()
+        logger.debug("Detection update published to Redis successfully for client %s", client_id)
     except Exception as e:
         logger.error(f"Failed to publish detection update to Redis for client {client_id}: {e}")
         # Redis fallback disabled since Redis is running in Docker
         pass
 
 async def send_page_count_update(client_id: str, total_pages: int):
-    print(f"{total_pages} pages detected")
-    logger.info(f"Sending page count update - Client: {client_id}, Total pages: {total_pages}")
+    logger.info("Sending page count update - Client: %s, Total pages: %d", client_id, total_pages)
     try:
         await redis_manager.publish_page_count_update(client_id, total_pages)
-        logger.debug(f"Page count update published to Redis successfully for client {client_id}")
+        logger.debug("Page count update published to Redis successfully for client %s", client_id)
     except Exception as e:
         logger.error(f"Failed to publish page count update to Redis for client {client_id}: {e}")
         # Redis fallback disabled since Redis is running in Docker  
         pass
 
 async def send_page_result_update(client_id: str, page_num: int, result: dict):
-    print(f"Page {page_num}: {result['orientation'].lower()}")
-    logger.info(f"Sending page result - Client: {client_id}, Page: {page_num}, Orientation: {result['orientation']}")
+    logger.info("Sending page result - Client: %s, Page: %d, Orientation: %s", client_id, page_num, result['orientation'])
     try:
         await redis_manager.publish_page_result_update(client_id, page_num, result)
-        logger.debug(f"Page result published to Redis successfully for client {client_id}, page {page_num}")
+        logger.debug("Page result published to Redis successfully for client %s, page %d", client_id, page_num)
     except Exception as e:
         logger.error(f"Failed to publish page result to Redis for client {client_id}, page {page_num}: {e}")
         # Redis fallback disabled since Redis is running in Docker
         pass
 
 
+async def load_cached_results(cache_key: str):
+    try:
+        return await redis_manager.get_cached_results(cache_key)
+    except Exception as e:
+        logger.error(f"Failed to read cached results from Redis for key {cache_key}: {e}")
+        return None
+
+async def store_cached_results(cache_key: str, results: dict):
+    try:
+        await redis_manager.cache_results(cache_key, results, RESULT_CACHE_TTL)
+        logger.debug("Cached detection results in Redis under key %s", cache_key)
+    except Exception as e:
+        logger.error(f"Failed to cache results in Redis for key {cache_key}: {e}")
+
+
 @app.get("/api/detection-status/{client_id}")
 async def get_detection_status(client_id: str):
     logger.info(f"Status request received for client {client_id}")
@@ -181,7 +317,9 @@ async def get_detection_status(client_id: str):
 
 @app.on_event("startup")
 async def startup():
+    global detection_semaphore
     logger.info("Starting FastAPI application...")
+    detection_semaphore = asyncio.Semaphore(MAX_IN_FLIGHT_PAGES)
     await redis_manager.connect()
     logger.info("Redis connection established successfully")
 
@@ -190,6 +328,8 @@ async def shutdown():
     logger.info("Shutting down FastAPI application...")
     await redis_manager.close()
     logger.info("Redis connection closed successfully")
+    shutdown_process_pool()
+    render_executor.shutdown(wait=False)
 
 if __name__ == "__main__":
     import uvicorn
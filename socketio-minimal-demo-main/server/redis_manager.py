@@ -1,15 +1,26 @@
 import redis.asyncio as aioredis
 import asyncio
-import json
+import orjson
 import logging
 
 logger = logging.getLogger(__name__)
 
 class RedisManager:
-    def __init__(self, host='localhost', port=6379):
+    def __init__(self, host='localhost', port=6379, batch_size=16, flush_interval=0.05):
         logger.info(f"Initializing Redis manager - Host: {host}, Port: {port}")
         self.redis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+        # Publishing and the result cache use a client without response decoding; cached payloads are orjson bytes
+        self.publisher_client = aioredis.Redis(host=host, port=port, decode_responses=False)
         self.pubsub = None
+        # Publishes are buffered and sent in one round trip every batch_size messages or flush_interval seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pipe = self.publisher_client.pipeline(transaction=False)
+        self._pending = 0
+        self._flush_task = None
+        # Serializes flushes so batches reach Redis in the order they were queued. Created on first
+        # flush because before Python 3.10 asyncio primitives bind to the loop current at construction
+        self._flush_lock = None
     
     async def connect(self):
         """Initialize Redis connection and pubsub"""
@@ -22,51 +33,90 @@ class RedisManager:
             logger.error(f"Failed to connect to Redis: {e}")
             raise
     
+    async def _queue_publish(self, channel: str, line: str):
+        """Buffer a publish on the shared pipeline, flushing once the batch is full"""
+        self._pipe.publish(channel, line)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_interval())
+    
+    async def _flush_after_interval(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Already logged by flush; nobody awaits this task
+            pass
+    
+    async def flush(self):
+        """Send all buffered publishes to Redis"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            # Swap in a fresh pipeline so publishes queued while this one executes are not lost
+            pipe, pending = self._pipe, self._pending
+            self._pipe = self.publisher_client.pipeline(transaction=False)
+            self._pending = 0
+            try:
+                results = await pipe.execute()
+                logger.debug("Flushed %d publishes to Redis - Subscribers: %s", pending, results)
+            except Exception as e:
+                logger.error(f"Failed to flush {pending} publishes to Redis: {e}")
+                raise
+    
     async def publish_detection_update(self, client_id: str, status: str, confidence: float, message: str):
         """Publish detection update to Redis"""
-        data = {
-            'type': 'DETECTION',
-            'client_id': client_id,
-            'status': status,
-            'confidence': confidence,
-            'message': message
-        }
+        # Payloads are the final WebSocket lines so the bridge can forward them untouched
+        line = f"DETECTION:{client_id}:{status}:{confidence}:{message}"
         try:
-            result = await self.redis_client.publish('detection_updates', json.dumps(data))
-            logger.debug(f"Published detection update to Redis - Client: {client_id}, Subscribers: {result}")
+            await self._queue_publish('detection_updates', line)
+            logger.debug("Queued detection update for Redis - Client: %s", client_id)
         except Exception as e:
             logger.error(f"Failed to publish detection update for client {client_id}: {e}")
             raise
     
     async def publish_page_count_update(self, client_id: str, total_pages: int):
         """Publish page count update to Redis"""
-        data = {
-            'type': 'PAGE_COUNT',
-            'client_id': client_id,
-            'total_pages': total_pages
-        }
+        line = f"PAGE_COUNT:{client_id}:{total_pages}"
         try:
-            result = await self.redis_client.publish('page_updates', json.dumps(data))
-            logger.debug(f"Published page count update to Redis - Client: {client_id}, Pages: {total_pages}, Subscribers: {result}")
+            await self._queue_publish('page_updates', line)
+            logger.debug("Queued page count update for Redis - Client: %s, Pages: %d", client_id, total_pages)
         except Exception as e:
             logger.error(f"Failed to publish page count update for client {client_id}: {e}")
             raise
     
     async def publish_page_result_update(self, client_id: str, page_num: int, result: dict):
         """Publish page result update to Redis"""
-        data = {
-            'type': 'PAGE_RESULT',
-            'client_id': client_id,
-            'page_num': page_num,
-            'result': result
-        }
+        line = f"PAGE_RESULT:{client_id}:{page_num}:{result['orientation']}:{result['aspect_ratio']}:{result['width']}:{result['height']}"
         try:
-            redis_result = await self.redis_client.publish('page_results', json.dumps(data))
-            logger.debug(f"Published page result to Redis - Client: {client_id}, Page: {page_num}, Orientation: {result.get('orientation', 'unknown')}, Subscribers: {redis_result}")
+            await self._queue_publish('page_results', line)
+            logger.debug("Queued page result for Redis - Client: %s, Page: %d, Orientation: %s", client_id, page_num, result.get('orientation', 'unknown'))
         except Exception as e:
             logger.error(f"Failed to publish page result for client {client_id}, page {page_num}: {e}")
             raise
     
+    async def get_cached_results(self, key: str):
+        """Fetch cached detection results, or None if the key is missing"""
+        try:
+            cached = await self.publisher_client.get(key)
+            return orjson.loads(cached) if cached else None
+        except Exception as e:
+            logger.error(f"Failed to read cached results for key {key}: {e}")
+            raise
+    
+    async def cache_results(self, key: str, results: dict, ttl: int):
+        """Store detection results under key for ttl seconds"""
+        try:
+            await self.publisher_client.setex(key, ttl, orjson.dumps(results))
+        except Exception as e:
+            logger.error(f"Failed to cache results for key {key}: {e}")
+            raise
+    
     async def listen_for_messages(self, callback):
         """Listen for Redis messages and call callback function"""
         logger.info("Starting Redis message listener...")
@@ -76,11 +126,8 @@ class RedisManager:
                 if message['type'] == 'message':
                     message_count += 1
                     try:
-                        data = json.loads(message['data'])
-                        logger.debug(f"Received Redis message #{message_count} on channel '{message['channel']}': {data.get('type', 'unknown')}")
-                        await callback(data)
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Failed to decode Redis message: {e}, Raw data: {message['data']}")
+                        logger.debug("Received Redis message #%d on channel '%s'", message_count, message['channel'])
+                        await callback(message['data'])
                     except Exception as e:
                         logger.error(f"Error processing Redis message: {e}")
         except Exception as e:
@@ -91,9 +138,14 @@ class RedisManager:
         """Close Redis connections"""
         logger.info("Closing Redis connections...")
         try:
+            if self._flush_task:
+                self._flush_task.cancel()
+                self._flush_task = None
+            await self.flush()
             if self.pubsub:
                 await self.pubsub.close()
                 logger.info("Redis pubsub connection closed")
+            await self.publisher_client.close()
             await self.redis_client.close()
             logger.info("Redis client connection closed successfully")
         except Exception as e:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules are imported as top-level modules, as main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,100 @@
+import fitz
+import numpy as np
+import pytest
+
+from detection_model import FOREGROUND_THRESHOLD, THUMBNAIL_SIZE, bbox_nonzero, detect_vertical_simple, iter_pdf_pages
+
+LETTER = (612, 792)
+
+
+def make_pdf(block, page_size=LETTER):
+    # Black background with one white text block
+    doc = fitz.open()
+    page = doc.new_page(width=page_size[0], height=page_size[1])
+    page.draw_rect(page.rect, color=None, fill=(0, 0, 0))
+    page.draw_rect(fitz.Rect(*block), color=None, fill=(1, 1, 1))
+    return doc
+
+
+def render(doc, scale):
+    pix = doc[0].get_pixmap(matrix=fitz.Matrix(scale, scale))
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+
+# Fractional edges on a Letter page. A 150pt block is only ~75px wide at 0.5x, so edge
+# rounding bounds agreement with the 2x render; the worst case measured over 300 random
+# blocks of at least 150pt was 2.4%, hence 3% rather than 1%.
+@pytest.mark.parametrize("block, expected_vertical", [
+    ((37.7, 101.3, 574.9, 388.6), False),
+    ((203.4, 55.2, 371.1, 731.8), True),
+    ((88.5, 240.3, 283.9, 413.7), False),
+    ((301.6, 98.1, 455.3, 366.9), True),
+])
+def test_aspect_ratio_matches_2x_render(block, expected_vertical):
+    with make_pdf(block) as doc:
+        is_vertical_2x, aspect_ratio_2x, _, _ = detect_vertical_simple(render(doc, 2.0))
+        pages = list(iter_pdf_pages(doc))
+
+    assert len(pages) == 1
+    _, total_pages, img_array = pages[0]
+    assert total_pages == 1
+    is_vertical, aspect_ratio, _, _ = detect_vertical_simple(img_array)
+
+    assert is_vertical == is_vertical_2x == expected_vertical
+    assert aspect_ratio == pytest.approx(aspect_ratio_2x, rel=0.03)
+
+
+# Blocks with fractional edges on a Letter page, from wide through near-square to tall
+@pytest.mark.parametrize("block", [
+    (41.3, 77.9, 563.7, 301.1),
+    (120.6, 210.2, 497.9, 618.4),
+    (233.1, 45.7, 389.5, 760.3),
+])
+def test_thumbnail_matches_full_resolution(block):
+    with make_pdf(block, LETTER) as doc:
+        img_array = render(doc, 2.0)
+    assert max(img_array.shape[:2]) > THUMBNAIL_SIZE
+
+    gray = img_array[:, :, 0]
+    full_w, full_h = bbox_nonzero(gray > FOREGROUND_THRESHOLD)
+    is_vertical, aspect_ratio, width, height = detect_vertical_simple(img_array)
+
+    # Thresholding after the resize keeps the error to about +-half a thumbnail pixel per edge,
+    # under 3% on the aspect ratio for blocks of at least 150pt
+    assert aspect_ratio == pytest.approx(full_w / full_h, rel=0.03)
+    assert width == pytest.approx(full_w, rel=0.03)
+    assert height == pytest.approx(full_h, rel=0.03)
+    assert is_vertical == (full_w < full_h)
+
+
+def test_faint_edge_pixels_are_not_foreground():
+    img_array = np.zeros((1000, 800), dtype=np.uint8)
+    img_array[90:910, 90:710] = 40
+    img_array[100:900, 100:700] = 255
+    is_vertical, aspect_ratio, width, height = detect_vertical_simple(img_array)
+    # The faint halo is 620x820; only the bright 600x800 block should be measured
+    assert width == pytest.approx(600, rel=0.01)
+    assert height == pytest.approx(800, rel=0.01)
+    assert aspect_ratio == pytest.approx(0.75, rel=0.01)
+    assert is_vertical
+
+
+def test_bbox_nonzero_blank():
+    assert bbox_nonzero(np.zeros((10, 20), dtype=np.uint8)) == (0, 0)
+
+
+def test_bbox_nonzero_single_pixel():
+    gray = np.zeros((10, 20), dtype=np.uint8)
+    gray[3, 5] = 255
+    assert bbox_nonzero(gray) == (1, 1)
+
+
+def test_bbox_nonzero_extents():
+    gray = np.zeros((10, 20), dtype=np.uint8)
+    gray[2, 4] = 1
+    gray[7, 15] = 1
+    assert bbox_nonzero(gray) == (12, 6)
+
+
+def test_detect_blank_image():
+    assert detect_vertical_simple(np.zeros((64, 64, 3), dtype=np.uint8)) == (False, 0, 0, 0)
@@ -0,0 +1,68 @@
+import asyncio
+
+from redis_manager import RedisManager
+
+
+class FakePipeline:
+    # Records publishes and holds execute() until the test opens its gate
+    def __init__(self, delivered):
+        self.delivered = delivered
+        self.lines = []
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    def publish(self, channel, line):
+        self.lines.append(line)
+
+    async def execute(self):
+        self.started.set()
+        await self.gate.wait()
+        self.delivered.extend(self.lines)
+        return [1] * len(self.lines)
+
+
+async def publish_pages(manager, pages):
+    for page in pages:
+        await manager.publish_page_count_update("c", page)
+
+
+async def run_concurrent_flushes():
+    delivered = []
+    pipes = []
+
+    def pipeline(transaction=True):
+        pipes.append(FakePipeline(delivered))
+        return pipes[-1]
+
+    manager = RedisManager(batch_size=3, flush_interval=0.01)
+    manager.publisher_client.pipeline = pipeline
+    manager._pipe = pipeline()
+
+    # Explicit flush: holds the lock in execute while the other flushes arrive
+    await publish_pages(manager, [0, 1])
+    explicit_flush = asyncio.create_task(manager.flush())
+    await pipes[0].started.wait()
+
+    # Size flush: the third publish fills the batch and waits behind the explicit flush, then the timer queues too
+    size_flush = asyncio.create_task(publish_pages(manager, [2, 3, 4]))
+    await asyncio.sleep(0.05)
+    pipes[0].gate.set()
+    await pipes[1].started.wait()
+
+    # Timer flush: published while the size flush executes, sent by the waiting timer
+    await publish_pages(manager, [5])
+
+    # Open the later gate first so a batch sent out of turn would land early
+    pipes[2].gate.set()
+    await asyncio.sleep(0.05)
+    pipes[1].gate.set()
+    await asyncio.gather(explicit_flush, size_flush)
+    await asyncio.sleep(0.05)
+    return delivered, manager._pending
+
+
+def test_concurrent_flushes_publish_in_order():
+    delivered, pending = asyncio.run(run_concurrent_flushes())
+
+    assert delivered == [f"PAGE_COUNT:c:{page}" for page in range(6)]
+    assert pending == 0
@@ -2,6 +2,7 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uuid
+import time
 import logging
 import asyncio
 from redis_manager import RedisManager
@@ -39,7 +40,23 @@ async def websocket_endpoint(websocket: WebSocket):
             logger.info(f"Received message from {connection_id}: {message}")
     except WebSocketDisconnect:
         logger.info(f"WebSocket connection closed: {connection_id}")
-        del connections[connection_id]
+    finally:
+        connections.pop(connection_id, None)
+
+async def broadcast(message: str):
+    """Send a message to all WebSocket clients concurrently and prune any that fail"""
+    # Snapshot so connections can be added or pruned while sends are in flight
+    targets = tuple(connections.items())
+    results = await asyncio.gather(*[connection.send_text(message) for _, connection in targets], return_exceptions=True)
+    disconnected_clients = []
+    for (connection_id, _), result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to broadcast to {connection_id}: {result}")
+            disconnected_clients.append(connection_id)
+            connections.pop(connection_id, None)
+    
+    if disconnected_clients:
+        logger.info(f"Removed {len(disconnected_clients)} disconnected clients: {disconnected_clients}")
 
 async def send_detection_update(client_id: str, status: str, confidence: float, message: str):
     update_data = {
@@ -48,73 +65,33 @@ async def send_detection_update(client_id: str, status: str, confidence: float,
         "status": status,
         "confidence": confidence,
         "message": message,
-        "timestamp": str(uuid.uuid4())[:8]
+        "timestamp": time.monotonic_ns()
     }
     
-    logger.info(f"Broadcasting detection update to {len(connections)} clients: {client_id} - {status} - {message}")
-    for connection_id, connection in connections.items():
-        try:
-            await connection.send_text(f"DETECTION:{client_id}:{status}:{confidence}:{message}")
-        except Exception as e:
-            logger.error(f"Failed to send detection update to {connection_id}: {e}")
+    logger.info("Broadcasting detection update to %d clients: %s - %s - %s", len(connections), client_id, status, message)
+    await broadcast(f"DETECTION:{client_id}:{status}:{confidence}:{message}")
 
 async def send_page_count_update(client_id: str, total_pages: int):
-    logger.info(f"Broadcasting page count to {len(connections)} clients: {client_id} - {total_pages} pages")
-    for connection_id, connection in connections.items():
-        try:
-            await connection.send_text(f"PAGE_COUNT:{client_id}:{total_pages}")
-        except Exception as e:
-            logger.error(f"Failed to send page count to {connection_id}: {e}")
+    logger.info("Broadcasting page count to %d clients: %s - %d pages", len(connections), client_id, total_pages)
+    await broadcast(f"PAGE_COUNT:{client_id}:{total_pages}")
 
 async def send_page_result_update(client_id: str, page_num: int, result: dict):
-    logger.info(f"Broadcasting page result to {len(connections)} clients: {client_id} - Page {page_num}: {result['orientation']}")
-    for connection_id, connection in connections.items():
-        try:
-            result_str = f"PAGE_RESULT:{client_id}:{page_num}:{result['orientation']}:{result['aspect_ratio']}:{result['width']}:{result['height']}"
-            await connection.send_text(result_str)
-        except Exception as e:
-            logger.error(f"Failed to send page result to {connection_id}: {e}")
+    logger.info("Broadcasting page result to %d clients: %s - Page %d: %s", len(connections), client_id, page_num, result['orientation'])
+    result_str = f"PAGE_RESULT:{client_id}:{page_num}:{result['orientation']}:{result['aspect_ratio']}:{result['width']}:{result['height']}"
+    await broadcast(result_str)
 
 @app.post("/api/send-message")
 async def send_message(request: MessageRequest):
     logger.info(f"Sending message to {len(connections)} WebSocket clients: {request.message}")
     # Send the raw message directly to websocket clients (not chat format)
-    for connection_id, connection in connections.items():
-        try:
-            await connection.send_text(request.message)
-        except Exception as e:
-            logger.error(f"Failed to send message to {connection_id}: {e}")
+    await broadcast(request.message)
     return {"status": "sent"}
 
-async def handle_redis_message(data):
-    """Handle messages from Redis and broadcast to WebSocket clients"""
-    logger.info(f"Received Redis message: {data['type']} for client {data.get('client_id', 'unknown')}")
-    
-    if data['type'] == 'DETECTION':
-        message = f"DETECTION:{data['client_id']}:{data['status']}:{data['confidence']}:{data['message']}"
-    elif data['type'] == 'PAGE_COUNT':
-        message = f"PAGE_COUNT:{data['client_id']}:{data['total_pages']}"
-    elif data['type'] == 'PAGE_RESULT':
-        result = data['result']
-        message = f"PAGE_RESULT:{data['client_id']}:{data['page_num']}:{result['orientation']}:{result['aspect_ratio']}:{result['width']}:{result['height']}"
-    else:
-        logger.warning(f"Unknown Redis message type: {data.get('type', 'missing')}")
-        return
-    
-    logger.info(f"Broadcasting Redis message to {len(connections)} WebSocket clients: {message[:100]}...")
+async def handle_redis_message(message: str):
+    """Forward pre-formatted Redis messages to WebSocket clients"""
+    logger.info("Broadcasting Redis message to %d WebSocket clients: %.100s...", len(connections), message)
     # Broadcast to all connected WebSocket clients
-    disconnected_clients = []
-    for connection_id, connection in list(connections.items()):
-        try:
-            await connection.send_text(message)
-        except Exception as e:
-            logger.error(f"Failed to broadcast to {connection_id}: {e}")
-            # Remove disconnected clients
-            disconnected_clients.append(connection_id)
-            connections.pop(connection_id, None)
-    
-    if disconnected_clients:
-        logger.info(f"Removed {len(disconnected_clients)} disconnected clients: {disconnected_clients}")
+    await broadcast(message)
 
 @app.on_event("startup")
 async def startup():